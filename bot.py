@@ -1,21 +1,615 @@
 import telebot
 from telebot import types
 import sqlite3
+import copy
+import bisect
+import functools
+import gzip
+import heapq
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
 from datetime import datetime, timedelta
 
 # ==================== CONFIGURATION ====================
 TOKEN = 'YOUR_TELEGRAM_BOT_TOKEN_HERE'
 ADMIN_ID = 123456789  # Replace with your Telegram user ID or set to None
+DATABASE_FILE = 'bot_database.db'
+
+# Multi-bot hosting: if this file exists, the single bot above is ignored and every
+# entry is served from this process. Format:
+# [{"name": "funnel1", "token": "123:ABC", "admin_id": 123456789, "database": "funnel1.db",
+#   "staging_chat_id": -1001234567890}, ...]
+BOTS_FILE = 'bots.json'
+
+# Update intake (load shedding)
+INTAKE_MAX_DEPTH = 1000        # Max updates waiting for a worker, per bot
+INTAKE_WORKERS = 8             # Threads running handlers
+STALE_CALLBACK_SECONDS = 30    # Drop button clicks that waited longer than this
+BUSY_TEXT = "⏳ Bot is busy, please try again in a moment"
+SHED_ANSWER_QUEUE_SIZE = 1000  # Answers to shed clicks waiting to be sent; more are skipped
+
+# Per-user anti-flood throttle
+THROTTLE_RATE = 1.0            # Tokens refilled per second
+THROTTLE_BURST = 5             # Max actions in a quick burst
+THROTTLE_MAX_USERS = 10000     # Buckets kept in memory (least recently used evicted)
+THROTTLE_TEXT = "🐢 Slow down! Please wait a moment"
+
+# On-demand profiling (/profile)
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_DIR = 'profiles'         # Collapsed-stack files for flamegraph.pl / speedscope
+
+# Structured logging
+LOG_FILE = 'logs/bot.log'        # JSON lines, rotated by size
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_QUEUE_SIZE = 10000           # Records beyond this are dropped, never waited on
+LOG_SAMPLE_RATES = {             # Fraction of INFO records kept for high-volume events
+    'handler.done': 0.25,
+    'update.shed': 0.1,
+}
+
+# Funnel analytics: upper bounds (seconds) of the stage latency histogram buckets
+FUNNEL_LATENCY_BUCKETS = [5, 15, 30, 60, 120, 300, 600, 1800, 3600, 3 * 3600,
+                          6 * 3600, 12 * 3600, 86400, 3 * 86400, 7 * 86400]
+
+# Channel membership verification (bot must be an admin of public join channels)
+MEMBERSHIP_TTL = 600             # Seconds a confirmed membership is trusted
+MEMBERSHIP_NEGATIVE_TTL = 15     # Seconds a "not a member"/unknown answer is cached
+MEMBERSHIP_CACHE_SIZE = 50000
+
+# Online database backups (/backup)
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL = 6 * 3600       # Seconds between scheduled snapshots
+BACKUP_KEEP = 10                 # Compressed snapshots kept on disk
+BACKUP_PAGES_PER_STEP = 64       # Pages copied per batch
+BACKUP_STEP_PAUSE = 0.01         # Seconds yielded to handlers between batches
+BACKUP_MAX_RESTARTS = 3          # Restarts caused by writers before copying in one step
+
+# Re-engagement reminders for users stalled on a step
+REMINDER_DELAY = 24 * 3600       # Seconds without progress before a nudge
+REMINDER_WINDOW = 300            # Seconds of upcoming reminders held in memory
+REMINDER_BATCH = 1000            # Max reminders loaded per refill
+REMINDER_TEXT = "👋 You're almost there! Finish your tasks to unlock the next video."
+
+# Outbound bulk sends (reminders, media checks), budgeted separately for each bot
+OUTBOUND_SEND_RATE = 20          # Messages per second per bot
+
+# Video registry validation
+MEDIA_STAGING_CHAT_ID = None     # Chat videos are re-sent to when validating (defaults to ADMIN_ID)
+MEDIA_REVALIDATE_AFTER = 24 * 3600  # Seconds before a video's file_id is checked again
+MEDIA_CHECK_INTERVAL = 600       # Seconds between validation passes
+MEDIA_CHECK_BATCH = 20           # Videos checked per pass
 # ======================================================
 
-bot = telebot.TeleBot(TOKEN)
+# ==================== TENANTS ====================
+
+# The bot whose update (or background job) this thread is working on
+tenant_context = threading.local()
+
+def current_tenant():
+    return tenant_context.tenant
+
+def set_current_tenant(tenant):
+    tenant_context.tenant = tenant
+
+class CurrentBot:
+    """Stands in for the TeleBot of the current tenant so handlers can keep using `bot`"""
+
+    def __getattr__(self, name):
+        return getattr(current_tenant().bot, name)
+
+bot = CurrentBot()
+
+class HandlerRegistry:
+    """Collects handlers at import time so every tenant's TeleBot gets the same set"""
+
+    def __init__(self):
+        self.message_handlers = []
+        self.callback_query_handlers = []
+
+    def message_handler(self, **kwargs):
+        def decorator(func):
+            self.message_handlers.append((func, kwargs))
+            return func
+        return decorator
+
+    def callback_query_handler(self, **kwargs):
+        def decorator(func):
+            self.callback_query_handlers.append((func, kwargs))
+            return func
+        return decorator
+
+    def attach(self, telegram_bot):
+        for func, kwargs in self.message_handlers:
+            telegram_bot.register_message_handler(func, **kwargs)
+        for func, kwargs in self.callback_query_handlers:
+            telegram_bot.register_callback_query_handler(func, **kwargs)
+
+handlers = HandlerRegistry()
+
+class Tenant:
+    """One hosted bot: its own token, admin and database, plus its own caches and budgets"""
+
+    def __init__(self, name, token, admin_id, db_file, staging_chat_id=None):
+        self.name = name
+        self.admin_id = admin_id
+        self.db_file = db_file
+        self.staging_chat_id = staging_chat_id
+
+        # Handlers run on the shared intake workers, not on telebot's own unbounded pool
+        self.bot = telebot.TeleBot(token, threaded=False)
+        handlers.attach(self.bot)
+        self.bot.process_new_updates = lambda updates: intake.submit(self, updates)
+
+        self.throttle = UserThrottle(THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS)
+        self.profiler = HandlerProfiler(self, PROFILE_SAMPLE_INTERVAL, PROFILE_DIR)
+        self.membership = MembershipVerifier(self, MEMBERSHIP_TTL, MEMBERSHIP_NEGATIVE_TTL,
+                                             MEMBERSHIP_CACHE_SIZE)
+        # Joins and leaves in the channels we administer arrive as updates; cache them for free
+        self.bot.register_chat_member_handler(self.membership.record_update)
+        self.backups = BackupManager(self, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP,
+                                     BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE, BACKUP_MAX_RESTARTS)
+        self.reminders = ReminderScheduler(self, REMINDER_WINDOW, REMINDER_BATCH)
+        self.media_validator = MediaValidator(self, MEDIA_CHECK_INTERVAL, MEDIA_REVALIDATE_AFTER,
+                                              MEDIA_CHECK_BATCH)
+
+    def start(self):
+        """Start background jobs and long polling on a thread of its own"""
+        self.backups.start()
+        self.reminders.start()
+        self.media_validator.start()
+        threading.Thread(target=self._poll, name=f"poll-{self.name}", daemon=True).start()
+
+    def _poll(self):
+        set_current_tenant(self)
+        try:
+            self.bot.infinity_polling(timeout=30, long_polling_timeout=5,
+                                      allowed_updates=['message', 'callback_query', 'chat_member'])
+        except Exception:
+            logger.exception("bot.crashed")
+
+def load_tenants():
+    """Bots listed in BOTS_FILE, or the single TOKEN/ADMIN_ID/DATABASE_FILE bot"""
+    if not os.path.exists(BOTS_FILE):
+        return [Tenant('default', TOKEN, ADMIN_ID, DATABASE_FILE, MEDIA_STAGING_CHAT_ID)]
+
+    with open(BOTS_FILE) as f:
+        configs = json.load(f)
+
+    # Queues and send budgets are keyed by name, backups by database file name
+    seen = set()
+    for c in configs:
+        c.setdefault('database', f"{c['name']}.db")
+        database = os.path.abspath(c['database'])
+        backup_name = os.path.splitext(os.path.basename(database))[0]
+        for kind, value in (('name', c['name']), ('database', database), ('backup name', backup_name)):
+            if (kind, value) in seen:
+                raise ValueError(f"{BOTS_FILE}: duplicate bot {kind} {value!r}")
+            seen.add((kind, value))
+
+    return [Tenant(c['name'], c['token'], c.get('admin_id'), c['database'], c.get('staging_chat_id'))
+            for c in configs]
+
+# ==================== LOGGING ====================
+
+logger = logging.getLogger('mubzebot')
+
+# Per-thread context of the update being handled, copied onto every record
+log_context = threading.local()
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message'}
+
+class ContextFilter(logging.Filter):
+    """Attach update context and sample high-volume events"""
+
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(record.msg)
+        if rate is not None and record.levelno < logging.WARNING and random.random() >= rate:
+            return False
+
+        for key in ('update_id', 'user_id', 'handler'):
+            if not hasattr(record, key):
+                setattr(record, key, getattr(log_context, key, None))
+        if not hasattr(record, 'tenant'):
+            tenant = getattr(tenant_context, 'tenant', None)
+            record.tenant = tenant.name if tenant else None
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread; drops them rather than block a handler"""
+
+    dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Runs under the handler lock, so `dropped` needs no lock of its own
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            # The queue has room again: report the gap once instead of per record
+            notice = logger.makeRecord(logger.name, logging.WARNING, __file__, 0, "log.dropped",
+                                       None, None, extra={'count': self.dropped})
+            try:
+                self.queue.put_nowait(notice)
+                self.dropped = 0
+            except queue.Full:
+                pass
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with all context fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def setup_logging():
+    """Route `logger` through a queue to a background writer thread"""
+    os.makedirs(os.path.dirname(LOG_FILE), exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter())
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setFormatter(JsonFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler)
+    listener.start()
+    return listener
+
+def traced(func):
+    """Record handler name and user in the log context and log its duration"""
+    @functools.wraps(func)
+    def wrapper(update, *args, **kwargs):
+        log_context.handler = func.__name__
+        log_context.user_id = update.from_user.id
+        started = time.monotonic()
+        try:
+            return func(update, *args, **kwargs)
+        finally:
+            logger.info("handler.done", extra={'duration_ms': round((time.monotonic() - started) * 1000, 1)})
+    return wrapper
+
+# ==================== UPDATE INTAKE ====================
+
+class UpdateIntake:
+    """Bounded per-bot queues between polling and handlers that shed load when full
+
+    The worker pool is shared; bots with pending updates are served round-robin so
+    a spike on one bot neither fills another bot's queue nor starves it of workers.
+    """
+
+    def __init__(self, max_depth, workers, stale_after, answer_queue_size):
+        self.max_depth = max_depth
+        self.workers = workers
+        self.stale_after = stale_after
+        self.queues = {}             # tenant name -> deque of pending updates
+        self.ready = deque()         # tenants with pending updates, in serving order
+        self.pending_callbacks = set()
+        self.cond = threading.Condition()
+        self.shed_count = 0
+        # Shed clicks are answered off the polling thread so shedding never slows intake
+        self.answers = queue.Queue(answer_queue_size)
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"intake-{i}", daemon=True).start()
+        threading.Thread(target=self._answer_loop, name="intake-answers", daemon=True).start()
+
+    def submit(self, tenant, updates):
+        """Queue new updates, shedding duplicates and overflow immediately"""
+        for update in updates:
+            # Acknowledge every update, queued or shed, so the next getUpdates moves past it;
+            # this replaces the bookkeeping done by the TeleBot.process_new_updates we override
+            if update.update_id > tenant.bot.last_update_id:
+                tenant.bot.last_update_id = update.update_id
+
+            call = update.callback_query
+            # Identical clicks from the same user collapse into the pending one
+            key = (tenant.name, call.from_user.id, call.data) if call else None
+
+            with self.cond:
+                queue = self.queues.setdefault(tenant.name, deque())
+                if key and key in self.pending_callbacks:
+                    reason = "duplicate"
+                elif len(queue) >= self.max_depth:
+                    reason = "full"
+                else:
+                    if not queue:
+                        self.ready.append(tenant.name)
+                    queue.append((time.monotonic(), key, tenant, update))
+                    if key:
+                        self.pending_callbacks.add(key)
+                    self.cond.notify()
+                    continue
+
+            self._shed(tenant, call, reason)
+
+    def _shed(self, tenant, call, reason):
+        self.shed_count += 1
+        logger.info("update.shed", extra={'reason': reason, 'queue_depth': len(self.queues.get(tenant.name, ()))})
+        if not call:
+            return
+        try:
+            # Answer cheaply so the button stops spinning; Telegram stops it anyway if we can't
+            self.answers.put_nowait((tenant, call.id, None if reason == "duplicate" else BUSY_TEXT))
+        except queue.Full:
+            pass
+
+    def _answer_loop(self):
+        while True:
+            tenant, call_id, text = self.answers.get()
+            try:
+                tenant.bot.answer_callback_query(call_id, text)
+            except Exception:
+                logger.exception("update.shed_answer_failed")
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready:
+                    self.cond.wait()
+                name = self.ready.popleft()
+                queue = self.queues[name]
+                received_at, key, tenant, update = queue.popleft()
+                if queue:
+                    self.ready.append(name)
+
+            set_current_tenant(tenant)
+            log_context.update_id = update.update_id
+            log_context.user_id = None
+            log_context.handler = None
+            try:
+                if key and time.monotonic() - received_at > self.stale_after:
+                    self._shed(tenant, update.callback_query, "stale")
+                else:
+                    telebot.TeleBot.process_new_updates(tenant.bot, [update])
+            except Exception:
+                logger.exception("update.failed")
+            finally:
+                if key:
+                    with self.cond:
+                        self.pending_callbacks.discard(key)
+
+intake = UpdateIntake(INTAKE_MAX_DEPTH, INTAKE_WORKERS, STALE_CALLBACK_SECONDS, SHED_ANSWER_QUEUE_SIZE)
+
+# ==================== ANTI-FLOOD ====================
+
+class TokenBucket:
+    """Classic token bucket: `burst` tokens, refilled at `rate` per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, now=None):
+        now = now or time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+class UserThrottle:
+    """Per-user token buckets with LRU eviction of idle users"""
+
+    def __init__(self, rate, burst, max_users):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, user_id):
+        with self.lock:
+            bucket = self.buckets.get(user_id)
+            if bucket:
+                self.buckets.move_to_end(user_id)
+            else:
+                bucket = self.buckets[user_id] = TokenBucket(self.rate, self.burst)
+                if len(self.buckets) > self.max_users:
+                    self.buckets.popitem(last=False)
+            return bucket.consume()
+
+class OutboundLimiter:
+    """Process-wide limiter for bulk sends with a separate budget per bot"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        """Block until `key` may send one more message"""
+        while True:
+            with self.lock:
+                bucket = self.buckets.setdefault(key, TokenBucket(self.rate, self.rate))
+                if bucket.consume():
+                    return
+            time.sleep(1 / self.rate)
+
+outbound = OutboundLimiter(OUTBOUND_SEND_RATE)
+
+# ==================== PROFILING ====================
+
+class HandlerProfiler:
+    """Sampling profiler for one bot's handlers, switched on from its admin chat"""
+
+    running = 0                      # Active profilers across all bots; handlers skip all work at 0
+    running_lock = threading.Lock()
+    root_code = None                 # Code object of the profiled() wrapper
+
+    def __init__(self, tenant, interval, output_dir):
+        self.tenant = tenant
+        self.interval = interval
+        self.output_dir = output_dir
+        self.active = False
+        self.lock = threading.Lock()
+        self.threads = {}            # thread ident -> handler running on it
+        self.samples = Counter()     # collapsed stack -> sample count
+        self.calls = Counter()
+        self.durations = Counter()
+        self.remaining = None
+        self.deadline = None
+        self.chat_id = None
+
+    def start(self, chat_id, seconds=None, updates=None):
+        """Profile for `seconds` or the next `updates` handler calls"""
+        with self.lock:
+            if self.active:
+                return False
+            self.samples.clear()
+            self.calls.clear()
+            self.durations.clear()
+            self.chat_id = chat_id
+            self.deadline = time.monotonic() + seconds if seconds else None
+            self.remaining = updates
+            self._set_active(True)
+
+        threading.Thread(target=self._sample_loop, name=f"profiler-{self.tenant.name}", daemon=True).start()
+        return True
+
+    def stop(self):
+        self._set_active(False)
+
+    def _set_active(self, active):
+        with HandlerProfiler.running_lock:
+            if active != self.active:
+                HandlerProfiler.running += 1 if active else -1
+                self.active = active
+
+    def enter(self, name):
+        with self.lock:
+            self.threads[threading.get_ident()] = name
+
+    def exit(self, name, duration):
+        with self.lock:
+            self.threads.pop(threading.get_ident(), None)
+            self.calls[name] += 1
+            self.durations[name] += duration
+            if self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self._set_active(False)
+
+    def _collapse(self, name, frame):
+        """Stack from the handler down to the sampled frame, `;`-joined"""
+        stack = []
+        while frame and frame.f_code is not self.root_code:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.append(name)
+        return ';'.join(reversed(stack))
+
+    def _sample_loop(self):
+        set_current_tenant(self.tenant)
+        started = time.monotonic()
+        while self.active and (self.deadline is None or time.monotonic() < self.deadline):
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                threads = list(self.threads.items())
+            for ident, name in threads:
+                frame = frames.get(ident)
+                if frame:
+                    self.samples[self._collapse(name, frame)] += 1
+
+        self._set_active(False)
+        try:
+            self._deliver(time.monotonic() - started)
+        except Exception:
+            logger.exception("profiler.deliver_failed")
+
+    def _deliver(self, elapsed):
+        # Handlers that began before the stop still call exit(); read a consistent copy
+        with self.lock:
+            calls = self.calls.copy()
+            durations = self.durations.copy()
+
+        summary = f"🔬 **PROFILE** ({elapsed:.0f}s, {sum(self.samples.values())} samples)\n\n"
+        for name, count in calls.most_common():
+            # Backticks keep the underscores in handler names from breaking Markdown
+            summary += f"• `{name}`: {count} calls, avg {durations[name] / count * 1000:.1f} ms\n"
+
+        if not self.samples:
+            bot.send_message(self.chat_id, summary + "\nNo handler activity captured.", parse_mode='Markdown')
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile_{self.tenant.name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.folded")
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(path, 'rb') as f:
+            bot.send_document(self.chat_id, f, caption=summary, parse_mode='Markdown')
+
+def profiled(func):
+    """Register a handler with its bot's profiler; a single flag check while all are off"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not HandlerProfiler.running:
+            return func(*args, **kwargs)
+        profiler = current_tenant().profiler
+        if not profiler.active:
+            return func(*args, **kwargs)
+
+        started = time.monotonic()
+        profiler.enter(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.exit(func.__name__, time.monotonic() - started)
+
+    HandlerProfiler.root_code = wrapper.__code__
+    return wrapper
 
 # ==================== DATABASE SETUP ====================
 
-def init_db():
-    """Initialize the database with required tables"""
-    conn = sqlite3.connect('bot_database.db', check_same_thread=False)
+def init_db(tenant):
+    """Initialize the tenant's database with required tables"""
+    conn = sqlite3.connect(tenant.db_file, check_same_thread=False)
     cursor = conn.cursor()
 
     # Users table to track progress
@@ -28,7 +622,10 @@ def init_db():
             share_completed BOOLEAN DEFAULT 0,
             last_video_received INTEGER DEFAULT 0,
             join_date TIMESTAMP,
-            last_active TIMESTAMP
+            last_active TIMESTAMP,
+            step_started_at REAL,
+            join_at REAL,
+            share_at REAL
         )
     ''')
 
@@ -38,12 +635,24 @@ def init_db():
             step_number INTEGER PRIMARY KEY,
             join_link TEXT,
             share_link TEXT,
-            video_file_id TEXT,
+            video_media_id TEXT REFERENCES media (file_unique_id),
             video_caption TEXT,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
 
+    # Videos, stored once per file_unique_id and shared by steps
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS media (
+            file_unique_id TEXT PRIMARY KEY,
+            file_id TEXT,
+            file_size INTEGER,
+            duration INTEGER,
+            last_validated REAL,
+            is_valid BOOLEAN DEFAULT 1
+        )
+    ''')
+
     # Admin settings
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS admin_settings (
@@ -52,20 +661,49 @@ def init_db():
         )
     ''')
 
+    # Funnel analytics, updated as progress happens
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS funnel_counts (
+            step_number INTEGER,
+            stage TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (step_number, stage)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS funnel_latency (
+            step_number INTEGER,
+            stage TEXT,
+            bucket INTEGER,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (step_number, stage, bucket)
+        )
+    ''')
+
+    # One pending reminder per user, found through the due_at index
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reminders (
+            user_id INTEGER PRIMARY KEY,
+            step_number INTEGER,
+            due_at REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due_at ON reminders (due_at)")
+
     # Insert default admin ID if provided
-    if ADMIN_ID:
+    if tenant.admin_id:
         cursor.execute('''
             INSERT OR REPLACE INTO admin_settings (setting_key, setting_value)
             VALUES ('admin_id', ?)
-        ''', (str(ADMIN_ID),))
+        ''', (str(tenant.admin_id),))
 
     conn.commit()
     conn.close()
-    print("✅ Database initialized successfully!")
+    logger.info("db.initialized", extra={'tenant': tenant.name})
 
 def get_db_connection():
-    """Get a database connection"""
-    conn = sqlite3.connect('bot_database.db', check_same_thread=False)
+    """Get a connection to the current tenant's database"""
+    conn = sqlite3.connect(current_tenant().db_file, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -73,7 +711,8 @@ def get_db_connection():
 
 def is_admin(user_id):
     """Check if user is admin"""
-    if ADMIN_ID and user_id == ADMIN_ID:
+    admin_id = current_tenant().admin_id
+    if admin_id and user_id == admin_id:
         return True
 
     conn = get_db_connection()
@@ -102,11 +741,14 @@ def get_or_create_user(user_id, username):
         # Create new user
         try:
             cursor.execute('''
-                INSERT INTO users (user_id, username, join_date, last_active)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO users (user_id, username, join_date, last_active, step_started_at)
+                VALUES (?, ?, ?, ?, ?)
             ''', (user_id, username,
                   datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                  datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                  time.time()))
+            record_funnel_event(cursor, 1, 'start')
+            schedule_reminder(cursor, user_id, 1)
             conn.commit()
 
             # Get the newly created user
@@ -127,15 +769,24 @@ def get_or_create_user(user_id, username):
     return user
 
 def get_step_config(step_number):
-    """Get configuration for a specific step"""
+    """Get configuration for a specific step; video_file_id is only set for a valid video"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM steps_config WHERE step_number = ?", (step_number,))
+    cursor.execute('''
+        SELECT s.*, CASE WHEN m.is_valid THEN m.file_id END AS video_file_id
+        FROM steps_config s LEFT JOIN media m ON m.file_unique_id = s.video_media_id
+        WHERE s.step_number = ?
+    ''', (step_number,))
     step = cursor.fetchone()
     conn.close()
     return step
 
-def set_step_config(step_number, join_link=None, share_link=None, video_file_id=None, video_caption=None):
+def step_configured(cursor, step_number):
+    """True if the admin has set up this step"""
+    cursor.execute("SELECT 1 FROM steps_config WHERE step_number = ?", (step_number,))
+    return cursor.fetchone() is not None
+
+def set_step_config(step_number, join_link=None, share_link=None, video_media_id=None, video_caption=None):
     """Set or update configuration for a step"""
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -155,9 +806,9 @@ def set_step_config(step_number, join_link=None, share_link=None, video_file_id=
         if share_link is not None:
             update_fields.append("share_link = ?")
             params.append(share_link)
-        if video_file_id is not None:
-            update_fields.append("video_file_id = ?")
-            params.append(video_file_id)
+        if video_media_id is not None:
+            update_fields.append("video_media_id = ?")
+            params.append(video_media_id)
         if video_caption is not None:
             update_fields.append("video_caption = ?")
             params.append(video_caption)
@@ -169,17 +820,506 @@ def set_step_config(step_number, join_link=None, share_link=None, video_file_id=
     else:
         # Insert new step
         cursor.execute('''
-            INSERT INTO steps_config (step_number, join_link, share_link, video_file_id, video_caption)
+            INSERT INTO steps_config (step_number, join_link, share_link, video_media_id, video_caption)
             VALUES (?, ?, ?, ?, ?)
-        ''', (step_number, join_link or '', share_link or '', video_file_id or '', video_caption or ''))
+        ''', (step_number, join_link or '', share_link or '', video_media_id or '', video_caption or ''))
     
     conn.commit()
     conn.close()
     return True
 
+# ==================== MEDIA REGISTRY ====================
+
+def register_media(video):
+    """Store a video under its file_unique_id (re-uploads update the same row); returns that id"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO media (file_unique_id, file_id, file_size, duration, last_validated, is_valid)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT (file_unique_id) DO UPDATE SET
+            file_id = excluded.file_id,
+            file_size = excluded.file_size,
+            duration = excluded.duration,
+            last_validated = excluded.last_validated,
+            is_valid = 1
+    ''', (video.file_unique_id, video.file_id, video.file_size, video.duration, time.time()))
+    conn.commit()
+    conn.close()
+    return video.file_unique_id
+
+def is_bad_file_error(error):
+    """True when Telegram rejected the file_id itself, not the chat or request"""
+    return (isinstance(error, telebot.apihelper.ApiTelegramException) and error.error_code == 400
+            and 'file' in (error.description or '').lower())
+
+def invalidate_media(media_id):
+    """Stop offering a video whose file_id Telegram rejected; True if it was still marked valid"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE media SET is_valid = 0, last_validated = ? WHERE file_unique_id = ? AND is_valid = 1",
+                   (time.time(), media_id))
+    changed = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    if changed:
+        logger.warning("media.invalidated", extra={'media_id': media_id})
+    return changed
+
+def alert_media_invalid(media_id):
+    """Tell the current bot's admin which steps lost their video"""
+    admin_id = current_tenant().admin_id
+    if not admin_id:
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT step_number FROM steps_config WHERE video_media_id = ? ORDER BY step_number",
+                   (media_id,))
+    steps = ', '.join(str(row['step_number']) for row in cursor.fetchall())
+    conn.close()
+    bot.send_message(
+        admin_id,
+        f"⚠️ The video for step(s) {steps or 'none'} is no longer valid.\n"
+        f"Re-upload it with /addvideo to restore it."
+    )
+
+class MediaValidator:
+    """Re-sends stale videos to a staging chat to catch dead file_ids before users do"""
+
+    def __init__(self, tenant, interval, revalidate_after, batch):
+        self.tenant = tenant
+        self.interval = interval
+        self.revalidate_after = revalidate_after
+        self.batch = batch
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"media-{self.tenant.name}", daemon=True).start()
+
+    def _run(self):
+        set_current_tenant(self.tenant)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.validate_stale()
+            except Exception:
+                logger.exception("media.validate_failed")
+
+    def validate_stale(self):
+        chat_id = self.tenant.staging_chat_id or self.tenant.admin_id
+        if not chat_id:
+            return
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT file_unique_id, file_id FROM media
+            WHERE is_valid = 1 AND last_validated < ?
+            ORDER BY last_validated LIMIT ?
+        ''', (time.time() - self.revalidate_after, self.batch))
+        rows = cursor.fetchall()
+        conn.close()
+
+        for row in rows:
+            outbound.acquire(self.tenant.name)
+            try:
+                sent = bot.send_video(chat_id, row['file_id'], disable_notification=True)
+            except Exception as e:
+                if is_bad_file_error(e):
+                    if invalidate_media(row['file_unique_id']):
+                        alert_media_invalid(row['file_unique_id'])
+                else:
+                    logger.warning("media.check_failed", exc_info=True, extra={'media_id': row['file_unique_id']})
+                continue
+
+            # Telegram may hand back a fresher file_id for the same file
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE media SET file_id = ?, last_validated = ? WHERE file_unique_id = ?
+            ''', (sent.video.file_id, time.time(), row['file_unique_id']))
+            conn.commit()
+            conn.close()
+
+            try:
+                bot.delete_message(chat_id, sent.message_id)
+            except:
+                pass
+
+# ==================== FUNNEL ANALYTICS ====================
+
+FUNNEL_STAGES = ['start', 'join', 'share', 'video']
+
+def record_funnel_event(cursor, step_number, stage, since=None):
+    """Count a user reaching `stage` of a step; `since` is when the timed interval began"""
+    cursor.execute('''
+        INSERT INTO funnel_counts (step_number, stage, count) VALUES (?, ?, 1)
+        ON CONFLICT (step_number, stage) DO UPDATE SET count = count + 1
+    ''', (step_number, stage))
+
+    if since:
+        bucket = bisect.bisect_left(FUNNEL_LATENCY_BUCKETS, time.time() - since)
+        cursor.execute('''
+            INSERT INTO funnel_latency (step_number, stage, bucket, count) VALUES (?, ?, ?, 1)
+            ON CONFLICT (step_number, stage, bucket) DO UPDATE SET count = count + 1
+        ''', (step_number, stage, bucket))
+
+def latency_quantile(histogram, q):
+    """Upper bound of the bucket holding quantile `q` (None for the open last bucket)"""
+    target = q * sum(histogram.values())
+    seen = 0
+    for bucket in sorted(histogram):
+        seen += histogram[bucket]
+        if seen >= target:
+            return FUNNEL_LATENCY_BUCKETS[bucket] if bucket < len(FUNNEL_LATENCY_BUCKETS) else None
+    return None
+
+def format_duration(seconds):
+    if seconds is None:
+        return f">{format_duration(FUNNEL_LATENCY_BUCKETS[-1])}"
+    for unit, size in (('d', 86400), ('h', 3600), ('m', 60)):
+        if seconds >= size:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+def get_funnel_report():
+    """Per-step conversion and stage latencies, read from the pre-aggregated tables"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT step_number, stage, count FROM funnel_counts ORDER BY step_number")
+    counts = cursor.fetchall()
+    cursor.execute("SELECT step_number, stage, bucket, count FROM funnel_latency")
+    latency_rows = cursor.fetchall()
+    conn.close()
+
+    steps = {}
+    for row in counts:
+        steps.setdefault(row['step_number'], {})[row['stage']] = row['count']
+
+    latencies = {}
+    for row in latency_rows:
+        latencies.setdefault((row['step_number'], row['stage']), {})[row['bucket']] = row['count']
+
+    if not steps:
+        return "❌ No funnel data yet."
+
+    response = "📈 **FUNNEL BY STEP** 📈\n"
+    response += "Join/share timed from step start, video from tasks done\n\n"
+    for step_number, stage_counts in steps.items():
+        started = stage_counts.get('start', 0)
+        response += f"**STEP {step_number}:**\n"
+        for stage in FUNNEL_STAGES:
+            count = stage_counts.get(stage, 0)
+            line = f"• {stage.capitalize()}: {count}"
+            if stage != 'start' and started:
+                line += f" ({count * 100 // started}%)"
+            histogram = latencies.get((step_number, stage))
+            if histogram:
+                line += (f" ⏱ p50 {format_duration(latency_quantile(histogram, 0.5))}"
+                         f" / p90 {format_duration(latency_quantile(histogram, 0.9))}")
+            response += line + "\n"
+        if started:
+            dropped = started - stage_counts.get('video', 0)
+            response += f"• Not finished: {dropped} ({dropped * 100 // started}%)\n"
+        response += "\n"
+
+    return response
+
+# ==================== MEMBERSHIP VERIFICATION ====================
+
+# Public channel links only; invite links (joinchat/+hash) can't be checked by the bot
+CHANNEL_LINK_RE = re.compile(r'^https?://(?:t|telegram)\.me/(?:s/)?([A-Za-z][A-Za-z0-9_]{3,})/?$')
+
+def channel_from_link(join_link):
+    """'@channel' for a public t.me link, None if the link can't be verified"""
+    match = CHANNEL_LINK_RE.match(join_link or '')
+    return f"@{match.group(1)}" if match else None
+
+class MembershipVerifier:
+    """Cached get_chat_member checks with negative caching and request coalescing"""
+
+    def __init__(self, tenant, ttl, negative_ttl, max_entries):
+        self.tenant = tenant
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.cache = OrderedDict()   # (chat, user_id) -> (is_member, expires_at)
+        self.inflight = {}           # (chat, user_id) -> {'done': Event, 'result': ...} of the lookup
+        self.lock = threading.Lock()
+
+    def _cached(self, key):
+        entry = self.cache.get(key)
+        if entry and entry[1] > time.monotonic():
+            self.cache.move_to_end(key)
+            return entry
+        return None
+
+    def _store(self, key, result):
+        ttl = self.ttl if result else self.negative_ttl
+        self.cache[key] = (result, time.monotonic() + ttl)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def is_member(self, chat, user_id):
+        """True/False, or None when Telegram won't say (bot not admin, API error)"""
+        key = (chat.lower(), user_id)
+        with self.lock:
+            entry = self._cached(key)
+            if entry:
+                return entry[0]
+            lookup = self.inflight.get(key)
+            leader = lookup is None
+            if leader:
+                lookup = self.inflight[key] = {'done': threading.Event(), 'result': None}
+
+        if not leader:
+            # Someone is already asking Telegram about this pair
+            lookup['done'].wait(10)
+            return lookup['result']
+
+        result = None
+        try:
+            result = self._fetch(chat, user_id)
+        finally:
+            with self.lock:
+                self._store(key, result)
+                del self.inflight[key]
+            lookup['result'] = result
+            lookup['done'].set()
+        return result
+
+    def record_update(self, update):
+        """chat_member handler: a user joined or left a channel, so the next click needs no lookup"""
+        if not update.chat.username:
+            return
+        key = (f"@{update.chat.username}".lower(), update.new_chat_member.user.id)
+        with self.lock:
+            self._store(key, self._is_member_status(update.new_chat_member))
+
+    def _fetch(self, chat, user_id):
+        try:
+            member = self.tenant.bot.get_chat_member(chat, user_id)
+        except Exception:
+            logger.warning("membership.check_failed", exc_info=True, extra={'chat': chat})
+            return None
+        return self._is_member_status(member)
+
+    @staticmethod
+    def _is_member_status(member):
+        if member.status == 'restricted':
+            return bool(member.is_member)
+        return member.status in ('creator', 'administrator', 'member')
+
+# ==================== BACKUPS ====================
+
+class BackupRestarted(Exception):
+    """Raised from the progress callback to abandon a paged copy writers keep restarting"""
+
+class BackupManager:
+    """Online snapshots through the sqlite3 backup API, gzipped and rotated"""
+
+    def __init__(self, tenant, backup_dir, interval, keep, pages_per_step, step_pause, max_restarts):
+        self.tenant = tenant
+        self.db_file = tenant.db_file
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.max_restarts = max_restarts
+        self.lock = threading.Lock()   # One snapshot at a time
+
+    def start(self):
+        threading.Thread(target=self._schedule_loop, name=f"backup-{self.tenant.name}", daemon=True).start()
+
+    def _schedule_loop(self):
+        set_current_tenant(self.tenant)
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.snapshot()
+            except Exception:
+                logger.exception("backup.failed")
+
+    def snapshot(self):
+        """Copy, verify, compress and rotate; returns the .db.gz path"""
+        with self.lock:
+            os.makedirs(self.backup_dir, exist_ok=True)
+            name = os.path.splitext(os.path.basename(self.db_file))[0]
+            # Microseconds keep a manual /backup from overwriting a scheduled one in the same second
+            raw_path = os.path.join(self.backup_dir, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.db")
+            gz_path = raw_path + '.gz'
+            started = time.monotonic()
+
+            try:
+                src = sqlite3.connect(self.db_file, check_same_thread=False)
+                try:
+                    if not self._paged_copy(src, raw_path):
+                        # Writers kept restarting the copy; take it in one read transaction instead
+                        logger.warning("backup.fallback", extra={'restarts': self.max_restarts})
+                        os.remove(raw_path)
+                        src.execute("VACUUM INTO ?", (raw_path,))
+                finally:
+                    src.close()
+
+                dst = sqlite3.connect(raw_path)
+                try:
+                    check = dst.execute("PRAGMA integrity_check").fetchone()[0]
+                finally:
+                    dst.close()
+                if check != 'ok':
+                    raise RuntimeError(f"Backup integrity check failed: {check}")
+
+                with open(raw_path, 'rb') as f_in, gzip.open(gz_path, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            except Exception:
+                # Never leave a partial snapshot behind for _rotate to count
+                if os.path.exists(gz_path):
+                    os.remove(gz_path)
+                raise
+            finally:
+                if os.path.exists(raw_path):
+                    os.remove(raw_path)
+
+            self._rotate(name)
+            logger.info("backup.done", extra={'path': gz_path, 'bytes': os.path.getsize(gz_path),
+                                              'duration_ms': round((time.monotonic() - started) * 1000, 1)})
+            return gz_path
+
+    def _paged_copy(self, src, raw_path):
+        """Copy in small steps; False if a write restarted it more than max_restarts times"""
+        state = {'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            # A write from another connection sends the copy back to the first page
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] > self.max_restarts:
+                    raise BackupRestarted()
+            state['remaining'] = remaining
+            time.sleep(self.step_pause)   # Each step holds the read lock only briefly; the pause lets writers in
+
+        dst = sqlite3.connect(raw_path)
+        try:
+            src.backup(dst, pages=self.pages_per_step, progress=progress)
+            return True
+        except BackupRestarted:
+            return False
+        finally:
+            dst.close()
+
+    def _rotate(self, name):
+        # Match the timestamp exactly: a bare prefix would let `shop` rotate away `shop_vip`'s snapshots
+        pattern = re.compile(re.escape(name) + r'_\d{8}_\d{6}_\d{6}\.db\.gz')
+        snapshots = sorted(f for f in os.listdir(self.backup_dir) if pattern.fullmatch(f))
+        for old in snapshots[:-self.keep]:
+            os.remove(os.path.join(self.backup_dir, old))
+
+# ==================== REMINDERS ====================
+
+class ReminderScheduler:
+    """Sends due reminders, holding only the next REMINDER_WINDOW of them in a heap"""
+
+    def __init__(self, tenant, window, batch):
+        self.tenant = tenant
+        self.window = window
+        self.batch = batch
+        self.heap = []               # (due_at, user_id, step_number)
+        self.loaded_until = 0        # Every reminder due before this is in the heap
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"reminders-{self.tenant.name}", daemon=True).start()
+
+    def notify(self, user_id, step_number, due_at):
+        """Called for new due times; only ones inside the loaded window need the heap"""
+        with self.lock:
+            if due_at < self.loaded_until:
+                heapq.heappush(self.heap, (due_at, user_id, step_number))
+                self.wakeup.set()
+
+    def _refill(self, now):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT user_id, step_number, due_at FROM reminders
+            WHERE due_at <= ? ORDER BY due_at LIMIT ?
+        ''', (now + self.window, self.batch))
+        rows = cursor.fetchall()
+        conn.close()
+
+        with self.lock:
+            self.heap = [(row['due_at'], row['user_id'], row['step_number']) for row in rows]
+            heapq.heapify(self.heap)
+            # A full batch may have cut the window short
+            self.loaded_until = rows[-1]['due_at'] if len(rows) == self.batch else now + self.window
+
+    def _run(self):
+        set_current_tenant(self.tenant)
+        while True:
+            try:
+                now = time.time()
+                with self.lock:
+                    due = self.heap[0] if self.heap else None
+                    if due and due[0] <= now:
+                        heapq.heappop(self.heap)
+                    needs_refill = not self.heap and now >= self.loaded_until
+
+                if due and due[0] <= now:
+                    self._dispatch(*due)
+                    continue
+                if needs_refill:
+                    self._refill(now)
+                    continue
+
+                self.wakeup.clear()
+                next_at = min(due[0], self.loaded_until) if due else self.loaded_until
+                self.wakeup.wait(max(0, next_at - now))
+            except Exception:
+                logger.exception("reminder.loop_failed")
+                time.sleep(5)
+
+    def _dispatch(self, due_at, user_id, step_number):
+        # Claim the row; if progress rescheduled it, due_at no longer matches
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM reminders WHERE user_id = ? AND due_at = ?", (user_id, due_at))
+        conn.commit()
+        claimed = cursor.rowcount
+        conn.close()
+        if not claimed:
+            return
+
+        try:
+            # Two messages, so two tokens from this bot's budget
+            outbound.acquire(self.tenant.name)
+            bot.send_message(user_id, REMINDER_TEXT)
+            outbound.acquire(self.tenant.name)
+            send_step_buttons(user_id, step_number)
+            logger.info("reminder.sent", extra={'user_id': user_id, 'step': step_number})
+        except Exception:
+            # Usually the user blocked the bot
+            logger.warning("reminder.send_failed", exc_info=True, extra={'user_id': user_id})
+
+def schedule_reminder(cursor, user_id, step_number):
+    """(Re)schedule the user's nudge; replacing the row cancels any earlier one"""
+    # Nothing to nudge towards past the last configured step (e.g. funnel finished)
+    if not step_configured(cursor, step_number):
+        cursor.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+        return
+
+    due_at = time.time() + REMINDER_DELAY
+    cursor.execute('''
+        INSERT OR REPLACE INTO reminders (user_id, step_number, due_at) VALUES (?, ?, ?)
+    ''', (user_id, step_number, due_at))
+    current_tenant().reminders.notify(user_id, step_number, due_at)
+
 # ==================== ADMIN FUNCTIONS ====================
 
-@bot.message_handler(commands=['admin'])
+@handlers.message_handler(commands=['admin'])
+@traced
+@profiled
 def admin_panel(message):
     if not is_admin(message.from_user.id):
         bot.reply_to(message, "⚠️ Access denied!")
@@ -191,6 +1331,7 @@ def admin_panel(message):
         types.InlineKeyboardButton("📋 View Steps", callback_data="admin_view_steps"),
         types.InlineKeyboardButton("👥 View Users", callback_data="admin_view_users"),
         types.InlineKeyboardButton("📊 Statistics", callback_data="admin_stats"),
+        types.InlineKeyboardButton("📈 Funnel", callback_data="admin_funnel"),
         types.InlineKeyboardButton("🔄 Reset Step", callback_data="admin_reset_step"),
         types.InlineKeyboardButton("🎬 Add Video", callback_data="admin_add_video")
     ]
@@ -202,11 +1343,17 @@ def admin_panel(message):
 
 # ==================== USER FLOW ====================
 
-@bot.message_handler(commands=['start'])
+@handlers.message_handler(commands=['start'])
+@traced
+@profiled
 def send_welcome(message):
     user_id = message.from_user.id
     username = message.from_user.username or "No username"
 
+    # Flood check before any DB or API work
+    if not current_tenant().throttle.allow(user_id):
+        return
+
     # Get or create user
     user = get_or_create_user(user_id, username)
 
@@ -235,11 +1382,13 @@ def send_step_buttons(user_id, step_number):
         share_completed = bool(user_data['share_completed'])
 
         # Join button
+        confirm_join_btn = None
         if join_completed:
             join_btn = types.InlineKeyboardButton("✅ Joined", callback_data=f"mark_join_{step_number}")
         else:
             if step_config and step_config['join_link'] and step_config['join_link'].startswith('http'):
                 join_btn = types.InlineKeyboardButton("📊 Join Channel", url=step_config['join_link'])
+                confirm_join_btn = types.InlineKeyboardButton("☑️ I've Joined", callback_data=f"mark_join_{step_number}")
             else:
                 join_btn = types.InlineKeyboardButton("📊 Join (Not Set)", callback_data="no_link_set")
 
@@ -254,6 +1403,8 @@ def send_step_buttons(user_id, step_number):
 
         # Add buttons one below the other
         markup.add(join_btn)
+        if confirm_join_btn:
+            markup.add(confirm_join_btn)
         markup.add(share_btn)
 
         # Check if both completed and video exists
@@ -304,11 +1455,18 @@ def send_step_buttons(user_id, step_number):
 
 # ==================== CALLBACK HANDLERS ====================
 
-@bot.callback_query_handler(func=lambda call: True)
+@handlers.callback_query_handler(func=lambda call: True)
+@traced
+@profiled
 def callback_handler(call):
     user_id = call.from_user.id
     data = call.data
 
+    # Flood check before any DB or API work
+    if not current_tenant().throttle.allow(user_id):
+        bot.answer_callback_query(call.id, THROTTLE_TEXT)
+        return
+
     # Handle simple callbacks first
     if data == "no_link_set":
         bot.answer_callback_query(call.id, "❌ Admin hasn't set this link yet")
@@ -334,6 +1492,7 @@ def callback_handler(call):
             types.InlineKeyboardButton("📋 View Steps", callback_data="admin_view_steps"),
             types.InlineKeyboardButton("👥 View Users", callback_data="admin_view_users"),
             types.InlineKeyboardButton("📊 Statistics", callback_data="admin_stats"),
+            types.InlineKeyboardButton("📈 Funnel", callback_data="admin_funnel"),
             types.InlineKeyboardButton("🔄 Reset Step", callback_data="admin_reset_step"),
             types.InlineKeyboardButton("🎬 Add Video", callback_data="admin_add_video")
         ]
@@ -356,12 +1515,30 @@ def callback_handler(call):
             conn = get_db_connection()
             cursor = conn.cursor()
 
+            # Verify against the channel when the link is checkable (cached, coalesced),
+            # unless this is the "✅ Joined" button of a join already recorded
+            cursor.execute("SELECT join_completed FROM users WHERE user_id = ? AND current_step = ?",
+                           (user_id, step_number))
+            progress = cursor.fetchone()
+            if not (progress and progress['join_completed']):
+                step_config = get_step_config(step_number)
+                channel = channel_from_link(step_config['join_link']) if step_config else None
+                if channel and current_tenant().membership.is_member(channel, user_id) is False:
+                    conn.close()
+                    bot.answer_callback_query(call.id, "❌ Please join the channel first!")
+                    return
+
             # Mark join as completed
             cursor.execute('''
                 UPDATE users
-                SET join_completed = 1
-                WHERE user_id = ? AND current_step = ?
-            ''', (user_id, step_number))
+                SET join_completed = 1, join_at = ?
+                WHERE user_id = ? AND current_step = ? AND join_completed = 0
+            ''', (time.time(), user_id, step_number))
+
+            if cursor.rowcount:
+                cursor.execute("SELECT step_started_at FROM users WHERE user_id = ?", (user_id,))
+                record_funnel_event(cursor, step_number, 'join', cursor.fetchone()['step_started_at'])
+                schedule_reminder(cursor, user_id, step_number)
 
             conn.commit()
             conn.close()
@@ -377,9 +1554,9 @@ def callback_handler(call):
             send_step_buttons(user_id, step_number)
             return
 
-        except Exception as e:
+        except Exception:
             bot.answer_callback_query(call.id, "❌ Error updating")
-            print(f"Error: {e}")
+            logger.exception("mark_join.failed", extra={'data': data})
             return
 
     elif data.startswith("mark_share_"):
@@ -391,9 +1568,14 @@ def callback_handler(call):
             # Mark share as completed
             cursor.execute('''
                 UPDATE users
-                SET share_completed = 1
-                WHERE user_id = ? AND current_step = ?
-            ''', (user_id, step_number))
+                SET share_completed = 1, share_at = ?
+                WHERE user_id = ? AND current_step = ? AND share_completed = 0
+            ''', (time.time(), user_id, step_number))
+
+            if cursor.rowcount:
+                cursor.execute("SELECT step_started_at FROM users WHERE user_id = ?", (user_id,))
+                record_funnel_event(cursor, step_number, 'share', cursor.fetchone()['step_started_at'])
+                schedule_reminder(cursor, user_id, step_number)
 
             conn.commit()
             conn.close()
@@ -409,9 +1591,9 @@ def callback_handler(call):
             send_step_buttons(user_id, step_number)
             return
 
-        except Exception as e:
+        except Exception:
             bot.answer_callback_query(call.id, "❌ Error updating")
-            print(f"Error: {e}")
+            logger.exception("mark_share.failed", extra={'data': data})
             return
 
     # Handle video requests - NO LIMITS!
@@ -423,7 +1605,7 @@ def callback_handler(call):
 
             # Check if user has completed both tasks
             cursor.execute('''
-                SELECT join_completed, share_completed
+                SELECT join_completed, share_completed, join_at, share_at
                 FROM users
                 WHERE user_id = ? AND current_step = ?
             ''', (user_id, step_number))
@@ -433,9 +1615,10 @@ def callback_handler(call):
             if user_progress and bool(user_progress['join_completed']) and bool(user_progress['share_completed']):
                 # Get video for this step
                 cursor.execute('''
-                    SELECT video_file_id, video_caption
-                    FROM steps_config
-                    WHERE step_number = ?
+                    SELECT s.video_media_id, s.video_caption, m.file_id AS video_file_id
+                    FROM steps_config s
+                    JOIN media m ON m.file_unique_id = s.video_media_id AND m.is_valid = 1
+                    WHERE s.step_number = ?
                 ''', (step_number,))
 
                 video_data = cursor.fetchone()
@@ -443,12 +1626,18 @@ def callback_handler(call):
                 if video_data and video_data['video_file_id']:
                     try:
                         # Send the video
-                        bot.send_video(
-                            user_id,
-                            video_data['video_file_id'],
-                            caption=video_data['video_caption'] or f"🎬 **Step {step_number} Video**",
-                            parse_mode='Markdown'
-                        )
+                        try:
+                            bot.send_video(
+                                user_id,
+                                video_data['video_file_id'],
+                                caption=video_data['video_caption'] or f"🎬 **Step {step_number} Video**",
+                                parse_mode='Markdown'
+                            )
+                        except Exception as e:
+                            # A dead file_id fails once here, not for every user after this one
+                            if is_bad_file_error(e) and invalidate_media(video_data['video_media_id']):
+                                alert_media_invalid(video_data['video_media_id'])
+                            raise
 
                         # Update user to next step
                         cursor.execute('''
@@ -456,9 +1645,19 @@ def callback_handler(call):
                             SET current_step = current_step + 1,
                                 join_completed = 0,
                                 share_completed = 0,
-                                last_video_received = ?
+                                last_video_received = ?,
+                                step_started_at = ?,
+                                join_at = NULL,
+                                share_at = NULL
                             WHERE user_id = ?
-                        ''', (step_number, user_id))
+                        ''', (step_number, time.time(), user_id))
+
+                        tasks_done_at = max(user_progress['join_at'] or 0, user_progress['share_at'] or 0)
+                        record_funnel_event(cursor, step_number, 'video', tasks_done_at)
+                        # The last video finishes the funnel; there is no next step to start
+                        if step_configured(cursor, step_number + 1):
+                            record_funnel_event(cursor, step_number + 1, 'start')
+                        schedule_reminder(cursor, user_id, step_number + 1)
 
                         conn.commit()
                         bot.answer_callback_query(call.id, "✅ Video sent! Moving to next step...")
@@ -472,9 +1671,9 @@ def callback_handler(call):
                         # Send next step buttons in a NEW message
                         send_step_buttons(user_id, step_number + 1)
 
-                    except Exception as e:
+                    except Exception:
                         bot.answer_callback_query(call.id, "❌ Error sending video")
-                        print(f"Video error: {e}")
+                        logger.exception("video.send_failed", extra={'step': step_number})
                 else:
                     bot.answer_callback_query(call.id, "❌ No video configured for this step")
             else:
@@ -483,9 +1682,9 @@ def callback_handler(call):
             conn.close()
             return
 
-        except Exception as e:
+        except Exception:
             bot.answer_callback_query(call.id, "❌ Error processing request")
-            print(f"Get video error: {e}")
+            logger.exception("get_video.failed", extra={'data': data})
             return
 
     # ==================== ADMIN CALLBACKS ====================
@@ -514,7 +1713,11 @@ def callback_handler(call):
         elif data == "admin_view_steps":
             conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM steps_config ORDER BY step_number")
+            cursor.execute('''
+                SELECT s.*, m.is_valid AS video_valid, m.file_size AS video_size, m.duration AS video_duration
+                FROM steps_config s LEFT JOIN media m ON m.file_unique_id = s.video_media_id
+                ORDER BY s.step_number
+            ''')
             steps = cursor.fetchall()
             conn.close()
 
@@ -524,7 +1727,13 @@ def callback_handler(call):
                     response += f"**STEP {step['step_number']}:**\n"
                     response += f"• Join: `{step['join_link'][:50] if step['join_link'] else '❌ NOT SET'}`\n"
                     response += f"• Share: `{step['share_link'][:50] if step['share_link'] else '❌ NOT SET'}`\n"
-                    response += f"• Video: {'✅ SET' if step['video_file_id'] else '❌ NOT SET'}\n"
+                    if step['video_valid'] is None:
+                        response += "• Video: ❌ NOT SET\n"
+                    elif step['video_valid']:
+                        response += (f"• Video: ✅ SET ({step['video_duration'] or 0}s, "
+                                     f"{(step['video_size'] or 0) / 1024 / 1024:.1f} MB)\n")
+                    else:
+                        response += "• Video: ⚠️ BROKEN - re-upload\n"
                     response += f"• Caption: {step['video_caption'][:40] if step['video_caption'] else 'No caption'}\n\n"
             else:
                 response = "❌ No steps configured yet."
@@ -574,7 +1783,7 @@ def callback_handler(call):
             configured_steps = cursor.fetchone()['total']
             
             # Videos configured
-            cursor.execute("SELECT COUNT(*) as total FROM steps_config WHERE video_file_id != ''")
+            cursor.execute("SELECT COUNT(*) as total FROM steps_config WHERE video_media_id != ''")
             videos_configured = cursor.fetchone()['total']
             
             # Total videos sent
@@ -601,6 +1810,9 @@ def callback_handler(call):
             
             bot.send_message(user_id, response, parse_mode='Markdown')
 
+        elif data == "admin_funnel":
+            bot.send_message(user_id, get_funnel_report(), parse_mode='Markdown')
+
         elif data == "admin_reset_step":
             msg = bot.send_message(
                 user_id,
@@ -657,6 +1869,7 @@ def admin_setup_step(message):
     except ValueError:
         bot.send_message(message.chat.id, "❌ Invalid format! Use: STEP|JOIN_LINK|SHARE_LINK")
     except Exception as e:
+        logger.exception("setup_step.failed")
         bot.send_message(message.chat.id, f"❌ Error: {e}")
 
 def admin_receive_video(message):
@@ -664,7 +1877,7 @@ def admin_receive_video(message):
         return
 
     if message.video:
-        video_file_id = message.video.file_id
+        media_id = register_media(message.video)
         video_caption = message.caption or ""
 
         msg = bot.send_message(
@@ -678,11 +1891,11 @@ def admin_receive_video(message):
         )
         
         # Store video info temporarily
-        bot.register_next_step_handler(msg, lambda m: admin_save_video(m, video_file_id, video_caption))
+        bot.register_next_step_handler(msg, lambda m: admin_save_video(m, media_id, video_caption))
     else:
         bot.send_message(message.chat.id, "❌ Please send a video file first!")
 
-def admin_save_video(message, video_file_id, existing_caption=""):
+def admin_save_video(message, media_id, existing_caption=""):
     if not is_admin(message.from_user.id):
         return
 
@@ -704,11 +1917,11 @@ def admin_save_video(message, video_file_id, existing_caption=""):
                 "Example: `1`",
                 parse_mode='Markdown'
             )
-            bot.register_next_step_handler(msg, lambda m: admin_save_video_final(m, video_file_id, caption))
+            bot.register_next_step_handler(msg, lambda m: admin_save_video_final(m, media_id, caption))
             return
         
         # Save video to step
-        set_step_config(step, video_file_id=video_file_id, video_caption=caption)
+        set_step_config(step, video_media_id=media_id, video_caption=caption)
 
         bot.send_message(
             message.chat.id,
@@ -721,9 +1934,10 @@ def admin_save_video(message, video_file_id, existing_caption=""):
     except ValueError:
         bot.send_message(message.chat.id, "❌ Invalid step number!")
     except Exception as e:
+        logger.exception("save_video.failed")
         bot.send_message(message.chat.id, f"❌ Error: {e}")
 
-def admin_save_video_final(message, video_file_id, caption):
+def admin_save_video_final(message, media_id, caption):
     if not is_admin(message.from_user.id):
         return
 
@@ -731,7 +1945,7 @@ def admin_save_video_final(message, video_file_id, caption):
         step = int(message.text.strip())
         
         # Save video to step
-        set_step_config(step, video_file_id=video_file_id, video_caption=caption)
+        set_step_config(step, video_media_id=media_id, video_caption=caption)
 
         bot.send_message(
             message.chat.id,
@@ -744,6 +1958,7 @@ def admin_save_video_final(message, video_file_id, caption):
     except ValueError:
         bot.send_message(message.chat.id, "❌ Invalid step number!")
     except Exception as e:
+        logger.exception("save_video_final.failed")
         bot.send_message(message.chat.id, f"❌ Error: {e}")
 
 def admin_reset_step(message):
@@ -775,11 +1990,14 @@ def admin_reset_step(message):
     except ValueError:
         bot.send_message(message.chat.id, "❌ Invalid step number!")
     except Exception as e:
+        logger.exception("reset_step.failed")
         bot.send_message(message.chat.id, f"❌ Error: {e}")
 
 # ==================== EASY VIDEO ADD COMMAND ====================
 
-@bot.message_handler(commands=['addvideo'])
+@handlers.message_handler(commands=['addvideo'])
+@traced
+@profiled
 def admin_add_video_command(message):
     if not is_admin(message.from_user.id):
         bot.reply_to(message, "⚠️ Access denied!")
@@ -800,10 +2018,10 @@ def admin_add_video_command(message):
 
             step = int(step_caption[0].strip())
             caption = step_caption[1].strip()
-            video_file_id = message.reply_to_message.video.file_id
+            media_id = register_media(message.reply_to_message.video)
 
             # Save video
-            set_step_config(step, video_file_id=video_file_id, video_caption=caption)
+            set_step_config(step, video_media_id=media_id, video_caption=caption)
 
             bot.reply_to(
                 message,
@@ -816,64 +2034,145 @@ def admin_add_video_command(message):
         except ValueError:
             bot.reply_to(message, "❌ Invalid step number!")
         except Exception as e:
+            logger.exception("addvideo.failed")
             bot.reply_to(message, f"❌ Error: {e}")
     else:
         bot.reply_to(message, "❌ Please reply to a video message with this command!")
 
+# ==================== BACKUP COMMAND ====================
+
+@handlers.message_handler(commands=['backup'])
+def admin_backup_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "⚠️ Access denied!")
+        return
+
+    bot.reply_to(message, "💾 Creating backup...")
+    # Runs off the intake workers so a big copy doesn't hold one up
+    threading.Thread(target=send_backup, args=(current_tenant(), message.chat.id),
+                     name="backup-manual", daemon=True).start()
+
+def send_backup(tenant, chat_id):
+    set_current_tenant(tenant)
+    try:
+        path = tenant.backups.snapshot()
+    except Exception as e:
+        logger.exception("backup.failed")
+        bot.send_message(chat_id, f"❌ Backup failed: {e}")
+        return
+
+    caption = f"✅ Backup verified: {os.path.basename(path)}"
+    # Telegram bots can't upload documents over 50 MB
+    if os.path.getsize(path) < 50 * 1024 * 1024:
+        with open(path, 'rb') as f:
+            bot.send_document(chat_id, f, caption=caption)
+    else:
+        bot.send_message(chat_id, f"{caption}\nSaved on server at {path}")
+
+# ==================== PROFILE COMMAND ====================
+
+@handlers.message_handler(commands=['profile'])
+def admin_profile_command(message):
+    if not is_admin(message.from_user.id):
+        bot.reply_to(message, "⚠️ Access denied!")
+        return
+
+    parts = message.text.split()
+    arg = parts[1].lower() if len(parts) > 1 else "30s"
+    profiler = current_tenant().profiler
+
+    if arg == "stop":
+        if profiler.active:
+            profiler.stop()
+            bot.reply_to(message, "🛑 Profiler stopping, results on the way...")
+        else:
+            bot.reply_to(message, "❌ Profiler is not running")
+        return
+
+    try:
+        amount = int(arg[:-1] if arg.endswith('s') else arg)
+        if amount <= 0:
+            raise ValueError(arg)
+    except ValueError:
+        bot.reply_to(message, "❌ Usage: /profile 30s | /profile 100 | /profile stop")
+        return
+
+    if arg.endswith('s'):
+        started = profiler.start(message.chat.id, seconds=amount)
+        window = f"{amount} seconds"
+    else:
+        started = profiler.start(message.chat.id, updates=amount)
+        window = f"next {amount} handler calls"
+
+    if started:
+        bot.reply_to(message, f"🔬 Profiling for {window}...")
+    else:
+        bot.reply_to(message, "❌ Profiler is already running")
+
 # ==================== BOT START ====================
 
 if __name__ == "__main__":
+    log_listener = setup_logging()
+
     print("🤖 Initializing database...")
     print("✅ UNLIMITED USERS SYSTEM")
     print("✅ NO MEMBER LIMITS")
 
-    # Clean up old database for fresh start
-    if os.path.exists('bot_database.db'):
-        try:
-            os.remove('bot_database.db')
-            print("🗑️ Removed old database for fresh start")
-        except:
-            print("⚠️ Could not remove old database, continuing...")
+    tenants = load_tenants()
+
+    for tenant in tenants:
+        set_current_tenant(tenant)
 
-    init_db()
+        # Clean up old database for fresh start
+        if os.path.exists(tenant.db_file):
+            try:
+                os.remove(tenant.db_file)
+                print(f"🗑️ Removed old database {tenant.db_file} for fresh start")
+            except:
+                print(f"⚠️ Could not remove old database {tenant.db_file}, continuing...")
 
-    if not ADMIN_ID:
-        print("\n⚠️ IMPORTANT: ADMIN_ID is not set!")
-        print("To get your Telegram ID:")
-        print("1. Open Telegram")
-        print("2. Search for @userinfobot")
-        print("3. Send /start to get your ID")
+        init_db(tenant)
 
-        try:
-            admin_input = input("\nEnter your Telegram ID (or press Enter to skip): ").strip()
-            if admin_input:
-                ADMIN_ID = int(admin_input)
-                print(f"✅ Admin ID set to: {ADMIN_ID}")
-
-                # Save to database
-                conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT OR REPLACE INTO admin_settings (setting_key, setting_value)
-                    VALUES ('admin_id', ?)
-                ''', (str(ADMIN_ID),))
-                conn.commit()
-                conn.close()
-            else:
-                print("⚠️ Bot will start without admin ID set")
-        except ValueError:
-            print("❌ Invalid ID format. Bot will start without admin ID.")
-        except Exception as e:
-            print(f"❌ Error: {e}")
+        if not tenant.admin_id:
+            print(f"\n⚠️ IMPORTANT: ADMIN_ID is not set for bot '{tenant.name}'!")
+            print("To get your Telegram ID:")
+            print("1. Open Telegram")
+            print("2. Search for @userinfobot")
+            print("3. Send /start to get your ID")
+
+            try:
+                admin_input = input("\nEnter your Telegram ID (or press Enter to skip): ").strip()
+                if admin_input:
+                    tenant.admin_id = int(admin_input)
+                    print(f"✅ Admin ID set to: {tenant.admin_id}")
+
+                    # Save to database
+                    conn = get_db_connection()
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        INSERT OR REPLACE INTO admin_settings (setting_key, setting_value)
+                        VALUES ('admin_id', ?)
+                    ''', (str(tenant.admin_id),))
+                    conn.commit()
+                    conn.close()
+                else:
+                    print("⚠️ Bot will start without admin ID set")
+            except ValueError:
+                print("❌ Invalid ID format. Bot will start without admin ID.")
+            except Exception as e:
+                print(f"❌ Error: {e}")
 
     print("\n" + "="*50)
     print("🤖 BOT STARTING - UNLIMITED USERS SYSTEM")
     print("="*50)
+    print(f"\n🤖 Hosting {len(tenants)} bot(s): {', '.join(t.name for t in tenants)}")
     print("\n✅ Commands for Users:")
     print("• /start - Begin or continue steps")
     print("\n✅ Commands for Admin:")
     print("• /admin - Open admin panel")
     print("• /addvideo STEP|CAPTION - Add video (reply to video)")
+    print("• /profile 30s | 100 | stop - Profile handlers")
+    print("• /backup - Snapshot the database now")
     print("\n⚡ Features:")
     print("• Admin panel button in welcome message for admins")
     print("• All buttons displayed vertically (one below another)")
@@ -881,9 +2180,17 @@ if __name__ == "__main__":
     print("\n🎉 UNLIMITED USERS - NO LIMITS!")
     print("="*50)
 
+    # Polling only enqueues; handlers for every bot run on the shared intake workers
+    intake.start()
+    for tenant in tenants:
+        tenant.start()
+
     try:
-        bot.infinity_polling(timeout=30, long_polling_timeout=5)
+        while True:
+            time.sleep(1)
     except KeyboardInterrupt:
         print("\n🛑 Bot stopped by user")
-    except Exception as e:
-        print(f"\n❌ Bot error: {e}")
\ No newline at end of file
+        for tenant in tenants:
+            tenant.bot.stop_polling()
+    finally:
+        log_listener.stop()